@@ -0,0 +1,31 @@
+from bs4 import BeautifulSoup
+from markdownify import MarkdownConverter, ATX
+
+
+# This module is kept separate from server.py so that batch_save's worker
+# processes can import parse_page by name. `fastmcp run` loads server.py
+# under a module name that the workers cannot import again.
+
+
+def make_soup(content, encoding=None) -> BeautifulSoup:
+    """Parse HTML with the C-backed lxml parser, falling back to html.parser"""
+    try:
+        return BeautifulSoup(content, 'lxml', from_encoding=encoding)
+    except Exception:
+        return BeautifulSoup(content, 'html.parser', from_encoding=encoding)
+
+
+def parse_page(content: bytes, encoding: str = None) -> tuple:
+    """Convert raw HTML to (title, description, markdown).
+    
+    Runs in a worker process, so it only takes and returns picklable values.
+    """
+    soup = make_soup(content, encoding)
+    # Convert the tree we already have instead of re-parsing it from a string;
+    # <head> content is left out, as the title goes into the metadata header
+    markdown = MarkdownConverter(heading_style=ATX).convert_soup(soup.body or soup).strip() + "\n"
+    
+    title = str(soup.title.string) if soup.title and soup.title.string else None
+    description = soup.find('meta', {'name': 'description'})
+    description = description.get('content', '') if description else ""
+    return title, description, markdown
@@ -1,19 +1,137 @@
 from fastmcp import FastMCP
-from bs4 import BeautifulSoup
-import requests
-import html2text
-from urllib.parse import urljoin
+from bs4.dammit import UnicodeDammit
+from lxml import etree
+from pybloom_live import ScalableBloomFilter
+import orjson
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import aiohttp
+import asyncio
+from urllib.parse import urljoin, urlparse
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 import os
+import re
+import sys
 import json
 import datetime
+import functools
+import time
 
 from dotenv import load_dotenv
-import os
+
+from page_parser import parse_page
 
 # Load environment variables from .env file
 load_dotenv()
 
-mcp = FastMCP("CrawlServer", dependencies=["uvicorn"])
+def _serialize_result(data) -> str:
+    """Serialize tool results as compact JSON with orjson.
+    
+    FastMCP's default serializer is already native (pydantic_core), but
+    indents with two spaces; compact output keeps large batch_save results
+    noticeably smaller for the client.
+    """
+    return orjson.dumps(data, default=str).decode()
+
+mcp = FastMCP(
+    "CrawlServer",
+    dependencies=["uvicorn", "lxml", "aiohttp", "pybloom-live", "requests-cache",
+                  "markdownify", "orjson"],
+    tool_serializer=_serialize_result,
+)
+
+# Maximum number of pages fetched in parallel by batch_save
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", 20))
+
+# Largest page body batch_save will download and convert, in bytes
+MAX_PAGE_BYTES = int(os.environ.get("MAX_PAGE_BYTES", 10 * 1024 * 1024))
+
+# Request timeout in seconds
+REQUEST_TIMEOUT = float(os.environ.get("REQUEST_TIMEOUT", 30))
+
+# Confirm skip_seen Bloom filter hits against an exact set of every URL
+EXACT_SEEN_LINKS = os.environ.get("EXACT_SEEN_LINKS", "").lower() in ("1", "true", "yes")
+
+# Seconds a page's link map is reused before map_links fetches it again;
+# 0 or less disables the cache
+LINK_CACHE_TTL = float(os.environ.get("LINK_CACHE_TTL", 300))
+
+# Maximum number of pages whose link maps are cached
+LINK_CACHE_SIZE = 50_000
+
+# Default headers sent with every request; compressed responses cut transfer size
+_HEADERS = {
+    "User-Agent": "md-webcrawl-mcp/1.0",
+    "Accept-Encoding": "gzip, deflate",
+}
+
+# Shared session so repeated requests reuse pooled keep-alive connections.
+# Responses with an ETag or Last-Modified header are kept in an on-disk cache
+# and revalidated with conditional requests, so unchanged pages are not
+# downloaded again on later runs.
+_SESSION = requests_cache.CachedSession(
+    "md-webcrawl-mcp",
+    backend="sqlite",
+    use_cache_dir=True,
+    cache_control=True,
+    expire_after=requests_cache.EXPIRE_IMMEDIATELY,
+)
+_SESSION.headers.update(_HEADERS)
+_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.3),
+)
+_SESSION.mount("http://", _adapter)
+_SESSION.mount("https://", _adapter)
+
+# Links already returned by map_links(skip_seen=True). A Bloom filter keeps
+# this to a few bits per URL, at the cost of rare false positives. With
+# EXACT_SEEN_LINKS set, Bloom hits are also confirmed against an exact set,
+# which never drops a new link but keeps every URL string in memory.
+_SEEN = ScalableBloomFilter(initial_capacity=100_000, error_rate=0.001)
+_SEEN_EXACT = set() if EXACT_SEEN_LINKS else None
+
+# Next free numeric suffix per file name, grouped by output directory
+_USED_NAMES = {}
+
+# Directories batch_save has already created
+_MKDIR_CACHE = set()
+
+# Worker processes for parse_page, shared across batch_save calls
+_PROCESS_POOL = None
+
+# url -> (fetched_at, links) for map_links, oldest fetch first
+_LINK_CACHE = OrderedDict()
+
+# Not available on every platform
+_O_CLOEXEC = getattr(os, 'O_CLOEXEC', 0)
+
+# Characters that are not allowed in file names on common filesystems
+_UNSAFE_CHARS = str.maketrans({c: '_' for c in '<>:"/\\|?*'})
+
+# Server-side page extensions stripped from saved file names
+_PAGE_EXT_RE = re.compile(r'\.(html?|php|aspx?|jsp)$', re.IGNORECASE)
+
+# urlparse results are immutable, so the same URL crawled again (within a
+# batch or across calls) reuses the earlier parse
+_urlparse = functools.lru_cache(maxsize=10_000)(urlparse)
+
+# Metadata header written at the top of every saved page
+_METADATA_HEADER = """---
+title: {title}
+url: {url}
+domain: {domain}
+description: {description}
+date_saved: {date}
+---
+
+""".format
+
 
 # Define default output path as a resource
 @mcp.resource("config://output_path")
@@ -191,8 +309,123 @@ def get_filepath() -> str:
     # Return absolute path
     return os.path.abspath(path)
 
+# Absolute http(s) links, except those pointing at YouTube
+_HREF_RE = re.compile(
+    r'https?://(?!(?:[^/?#]*\.)?(?:youtube\.com|youtu\.be)(?:[:/?#]|$))',
+    re.IGNORECASE,
+)
+
+
+class _LinkCollector:
+    """lxml parser target that keeps only <a href> links and their text.
+    
+    No element tree is built, so tags other than anchors never become
+    Python objects.
+    """
+    
+    def __init__(self):
+        self.links = {}
+        self._href = None
+        self._text = []
+    
+    def start(self, tag, attrib):
+        if tag == 'a':
+            self._href = attrib.get('href')
+            self._text = []
+    
+    def data(self, data):
+        if self._href is not None:
+            self._text.append(data)
+    
+    def end(self, tag):
+        if tag == 'a' and self._href is not None:
+            href = self._href
+            if _HREF_RE.match(href):
+                self.links[href] = ''.join(self._text).strip() or href
+            self._href = None
+    
+    def close(self):
+        return self.links
+
+
+def _header_charset(content_type: str):
+    """Return the charset named in a Content-Type header, or None"""
+    for param in content_type.split(';')[1:]:
+        key, _, value = param.partition('=')
+        if key.strip().lower() == 'charset':
+            return value.strip().strip('"\'') or None
+    return None
+
+
+def _cached_links(url: str) -> dict:
+    """Return the link map for url, reusing one fetched in the last LINK_CACHE_TTL seconds.
+    
+    Entries are kept in fetch order, so expired ones are dropped from the
+    front of _LINK_CACHE and never hold slots. Failed fetches raise and are
+    not cached. A TTL of 0 or less disables the cache.
+    """
+    if LINK_CACHE_TTL <= 0:
+        return _fetch_and_parse_links(url)
+    
+    now = time.monotonic()
+    while _LINK_CACHE:
+        oldest_url, (fetched_at, _) = next(iter(_LINK_CACHE.items()))
+        if now - fetched_at < LINK_CACHE_TTL:
+            break
+        del _LINK_CACHE[oldest_url]
+    
+    entry = _LINK_CACHE.get(url)
+    if entry is not None:
+        return entry[1]
+    
+    links = _fetch_and_parse_links(url)
+    _LINK_CACHE[url] = (now, links)
+    if len(_LINK_CACHE) > LINK_CACHE_SIZE:
+        _LINK_CACHE.popitem(last=False)
+    return links
+
+
+def _fetch_and_parse_links(url: str) -> dict:
+    """Fetch a webpage and map its absolute links to their link text"""
+    response = _SESSION.get(url, timeout=(5, REQUEST_TIMEOUT))
+    response.raise_for_status()
+    
+    # libxml2 ignores the HTTP header and falls back to Latin-1 for pages
+    # without <meta charset>, so decode here: the header charset is tried
+    # first, then BOM / <meta> / content sniffing as BeautifulSoup does
+    markup = None
+    if response.content:
+        charset = _header_charset(response.headers.get('Content-Type', ''))
+        markup = UnicodeDammit(response.content, [charset] if charset else [],
+                               is_html=True).unicode_markup
+    
+    # Only anchors are needed, so parse into a collector target instead of a
+    # tree. The body is not streamed: the caching session reads it in full to
+    # store it, so it is already in memory here.
+    collector = _LinkCollector()
+    parser = etree.HTMLParser(target=collector)
+    parser.feed(markup if markup is not None else response.content)
+    try:
+        return parser.close()
+    except etree.XMLSyntaxError:
+        # Raised for a document with no elements at all; that just has no links
+        return collector.links
+
+
+def _seen_before(href: str) -> bool:
+    """Return True if href was returned by an earlier skip_seen call, else record it"""
+    if _SEEN_EXACT is None:
+        # add() reports whether the key was (probably) already present
+        return _SEEN.add(href)
+    if href in _SEEN and href in _SEEN_EXACT:
+        return True
+    _SEEN.add(href)
+    _SEEN_EXACT.add(href)
+    return False
+
+
 @mcp.tool()
-def map_links(url: str) -> dict:
+def map_links(url: str, skip_seen: bool = False) -> dict:
     """Extract and map all links from a webpage for web crawling.
     
     Scrapes the given URL to find all anchor tags and extracts their href values.
@@ -201,6 +434,8 @@ def map_links(url: str) -> dict:
     
     Args:
         url: The URL to crawl and extract links from (must be valid HTTP/HTTPS)
+        skip_seen: Leave out links already returned by earlier skip_seen calls,
+                   so pages of the same site can be mapped without repeats
         
     Returns:
         Dictionary containing:
@@ -221,18 +456,23 @@ def map_links(url: str) -> dict:
         
     Notes:
         - Only extracts absolute URLs (starting with http:// or https://)
+        - Links to youtube.com and youtu.be are left out
         - Link text is cleaned and trimmed
+        - Results are cached per URL for LINK_CACHE_TTL seconds, after which
+          the page is revalidated against an on-disk HTTP cache
+        - skip_seen uses a Bloom filter (about 0.1% false positives), so a
+          small number of unseen links may be skipped unless the server runs
+          with EXACT_SEEN_LINKS=1
         - Handles common web crawling errors gracefully
     """
     try:
-        response = requests.get(url)
-        soup = BeautifulSoup(response.content, 'html.parser')
-        links = {}
+        # Copy so callers never mutate the cached result
+        links = dict(_cached_links(url))
         
-        for a in soup.find_all('a', href=True):
-            href = a['href']
-            if href.startswith('http') and 'youtube.com' not in href and 'youtu.be' not in href:
-                links[href] = a.text.strip() or href
+        if skip_seen:
+            # Keys are already unique within the page, so only cross-call
+            # repeats are removed here
+            links = {href: text for href, text in links.items() if not _seen_before(href)}
         
         return {
             "status": "success",
@@ -243,10 +483,217 @@ def map_links(url: str) -> dict:
 
 
 
+def _get_process_pool() -> ProcessPoolExecutor:
+    """Return the shared page-parsing pool, creating it on first use.
+    
+    Workers are started with "spawn" rather than forked, because the server
+    process is already running threads (aiohttp resolver, to_thread workers).
+    """
+    global _PROCESS_POOL
+    if _PROCESS_POOL is None:
+        _PROCESS_POOL = ProcessPoolExecutor(
+            max_workers=os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _PROCESS_POOL
+
+
+def _reset_process_pool() -> None:
+    """Drop a broken pool so the next page starts a new one"""
+    global _PROCESS_POOL
+    if _PROCESS_POOL is not None:
+        _PROCESS_POOL.shutdown(wait=False)
+        _PROCESS_POOL = None
+
+
+async def _save_page(session: aiohttp.ClientSession, semaphore: asyncio.Semaphore,
+                     url: str, base_path: str,
+                     by_domain: defaultdict, date_saved: str) -> dict:
+    """Fetch a single webpage and save it as markdown below base_path.
+    
+    On success, the page's (title, relative path) index entry is stored in
+    by_domain under its domain.
+    """
+    try:
+        # Parse URL into directory structure
+        parsed_url = _urlparse(url)
+        
+        # Many URLs share a domain, so keep a single copy of the string
+        domain = sys.intern(parsed_url.netloc)
+        
+        # Reserve this page's index slot before the first await: tasks start
+        # in creation order, so the index keeps the order of the input URLs
+        entries = by_domain[domain]
+        slot = len(entries)
+        entries.append(None)
+        
+        # Extract content, rejecting non-HTML and oversized responses before
+        # any parsing happens
+        skip_reason = None
+        async with semaphore:
+            async with session.get(url) as response:
+                content_type = response.headers.get('Content-Type', '')
+                # Only set when the Content-Type header names a charset;
+                # otherwise the parser detects it from <meta charset> or BOM
+                encoding = response.charset
+                # aiohttp lowercases the mimetype and strips its parameters
+                if 'html' not in response.content_type:
+                    skip_reason = f"Content-Type is not HTML: {content_type or 'missing'}"
+                elif (response.content_length or 0) > MAX_PAGE_BYTES:
+                    skip_reason = f"Content-Length exceeds {MAX_PAGE_BYTES} bytes"
+                else:
+                    content = await _read_limited(response, MAX_PAGE_BYTES)
+                    if content is None:
+                        skip_reason = f"Body exceeds {MAX_PAGE_BYTES} bytes"
+        if skip_reason:
+            return {
+                "url": url,
+                "status": "skipped",
+                "reason": skip_reason
+            }
+        
+        # Parsing and markdown conversion are CPU-bound, so run them in the
+        # process pool instead of blocking the event loop
+        loop = asyncio.get_running_loop()
+        try:
+            title, description, markdown = await loop.run_in_executor(
+                _get_process_pool(), parse_page, content, encoding)
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next page
+            _reset_process_pool()
+            raise
+        
+        # Create domain-specific directory
+        domain_dir = _safe_name(domain)  # Handle ports in domain
+        
+        # Split path into components and clean them
+        path_parts = [_safe_name(p) for p in parsed_url.path.split('/') if p]
+        if not path_parts:
+            path_parts = ['index']
+            
+        # Clean the last part to be the filename
+        filename = _PAGE_EXT_RE.sub('', path_parts[-1])
+        if not filename:
+            filename = 'index'
+        
+        # Create the full directory path
+        file_dir = os.path.join(base_path, domain_dir, *path_parts[:-1])
+        _ensure_dir(file_dir)
+        
+        title = title or filename
+        
+        # Add metadata header
+        metadata = _METADATA_HEADER(
+            title=title,
+            url=url,
+            domain=domain,
+            description=description,
+            date=date_saved,
+        )
+        full_content = metadata + markdown
+        
+        # Claim a unique filename before handing off the write, so that
+        # concurrent pages with the same name cannot pick the same path
+        filepath, fd = _reserve_file(file_dir, filename)
+        
+        # Save file
+        await asyncio.to_thread(_write_and_close, fd, full_content)
+        
+        # Record the index entry, reusing the path parts computed above
+        relative_path = os.path.join(domain_dir, *path_parts[:-1], os.path.basename(filepath))
+        entries[slot] = (title, relative_path)
+        
+        return {
+            "url": url,
+            "status": "saved",
+            "path": filepath,
+            "title": title
+        }
+        
+    except Exception as e:
+        return {
+            "url": url, 
+            "status": "error",
+            "error": str(e)
+        }
+
+
+async def _read_limited(response: aiohttp.ClientResponse, limit: int):
+    """Read a response body, or return None as soon as it exceeds limit bytes"""
+    chunks = []
+    size = 0
+    async for chunk in response.content.iter_chunked(65536):
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _safe_name(part: str) -> str:
+    """Make one URL component usable as a file or directory name.
+    
+    "." and ".." are replaced too, so a URL path cannot climb out of base_path.
+    """
+    if part in ('.', '..'):
+        return '_'
+    return part.translate(_UNSAFE_CHARS)
+
+
+def _ensure_dir(path: str) -> None:
+    """Create a directory once; later calls for the same path are free"""
+    if path not in _MKDIR_CACHE:
+        os.makedirs(path, exist_ok=True)
+        _MKDIR_CACHE.add(path)
+
+
+def _reserve_file(file_dir: str, filename: str) -> tuple:
+    """Create a new, uniquely named markdown file and return (path, fd).
+    
+    The next free suffix for each name is remembered in _USED_NAMES, so
+    collisions cost one dict lookup instead of a stat() per candidate.
+    O_EXCL still guards against files that already existed on disk.
+    """
+    used = _USED_NAMES.setdefault(file_dir, {})
+    base = os.path.join(file_dir, filename)
+    n = used.get(filename, 0)
+    while True:
+        filepath = f"{base}.md" if n == 0 else f"{base}_{n}.md"
+        try:
+            fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_EXCL | _O_CLOEXEC, 0o644)
+        except FileExistsError:
+            n += 1
+            continue
+        except FileNotFoundError:
+            # Directory was removed since it was cached; recreate it and
+            # forget the suffixes recorded for its old contents
+            _MKDIR_CACHE.discard(file_dir)
+            _ensure_dir(file_dir)
+            used = _USED_NAMES[file_dir] = {}
+            n = 0
+            continue
+        used[filename] = n + 1
+        return filepath, fd
+
+
+def _write_and_close(fd: int, content: str) -> None:
+    """Encode content once and write it to fd with raw os.write calls, then close it"""
+    data = memoryview(content.encode('utf-8'))
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+
+
 @mcp.tool()
-def batch_save(urls: list, path: str = None) -> dict:
+async def batch_save(urls: list, path: str = None) -> dict:
     """Batch process and save multiple webpages for web crawling.
     
+    Pages are fetched concurrently, up to MAX_CONCURRENT_REQUESTS at a time,
+    and converted to markdown in a pool of worker processes. Responses that
+    are not HTML or are larger than MAX_PAGE_BYTES are skipped.
+    
     Args:
         urls: List of URLs to process and save (can be either list of URLs or 
               dictionary from map_links() output)
@@ -263,107 +710,45 @@ def batch_save(urls: list, path: str = None) -> dict:
             "status": "error",
             "error": "urls must be either a list of URLs or map_links() output dictionary"
         }
-    results = []
-    h2t = html2text.HTML2Text()
-    h2t.ignore_links = False
-    
     # Use fallback logic to get base output path
     base_path = path if path else get_filepath()
-        
-    for url in urls:
-        try:
-            # Extract content
-            response = requests.get(url)
-            soup = BeautifulSoup(response.content, 'html.parser')
-            markdown = h2t.handle(str(soup))
-            
-            # Parse URL into directory structure
-            from urllib.parse import urlparse
-            parsed_url = urlparse(url)
-            
-            # Create domain-specific directory
-            domain_dir = parsed_url.netloc.replace(':', '_')  # Handle ports in domain
-            
-            # Split path into components and clean them
-            path_parts = [p for p in parsed_url.path.split('/') if p]
-            if not path_parts:
-                path_parts = ['index']
-                
-            # Clean the last part to be the filename
-            filename = path_parts[-1].replace('.html', '').replace('.php', '')
-            if not filename:
-                filename = 'index'
-            
-            # Create the full directory path
-            file_dir = os.path.join(base_path, domain_dir, *path_parts[:-1])
-            os.makedirs(file_dir, exist_ok=True)
-            
-            # Generate unique filename if needed
-            filepath = os.path.join(file_dir, f"{filename}.md")
-            counter = 1
-            while os.path.exists(filepath):
-                filepath = os.path.join(file_dir, f"{filename}_{counter}.md")
-                counter += 1
-            
-            # Extract metadata
-            title = soup.title.string if soup.title else filename
-            description = soup.find('meta', {'name': 'description'})
-            description = description.get('content', '') if description else ""
-            
-            # Add metadata header
-            metadata = f"""---
-title: {title}
-url: {url}
-domain: {parsed_url.netloc}
-description: {description}
-date_saved: {datetime.datetime.now().isoformat()}
----
-
-"""
-            full_content = metadata + markdown
-            
-            # Save file
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(full_content)
-            
-            results.append({
-                "url": url,
-                "status": "saved",
-                "path": filepath,
-                "title": title
-            })
-            
-        except Exception as e:
-            results.append({
-                "url": url, 
-                "status": "error",
-                "error": str(e)
-            })
+    
+    # Index entries grouped by domain, filled in as pages are saved
+    by_domain = defaultdict(list)
+    
+    # One timestamp for the whole batch rather than one per page
+    date_saved = datetime.datetime.now().isoformat(timespec='seconds')
+    
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(sock_connect=5, sock_read=REQUEST_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, headers=_HEADERS,
+                                     timeout=timeout) as session:
+        tasks = [
+            asyncio.create_task(
+                _save_page(session, semaphore, url, base_path, by_domain, date_saved))
+            for url in urls
+        ]
+        results = await asyncio.gather(*tasks)
     
     # Create an index file
     try:
-        index_content = "# Crawled Content Index\n\n"
-        
-        # Group results by domain
-        from collections import defaultdict
-        by_domain = defaultdict(list)
-        
-        for result in results:
-            if result["status"] == "saved":
-                domain = urlparse(result["url"]).netloc
-                by_domain[domain].append(result)
+        # Collect the pieces and join once; repeated += on a str is quadratic
+        parts = ["# Crawled Content Index\n\n"]
         
-        # Create index entries
+        # Create index entries; pages that failed left their slot as None
         for domain, entries in by_domain.items():
-            index_content += f"\n## {domain}\n\n"
-            for entry in entries:
-                relative_path = os.path.relpath(entry["path"], base_path)
-                index_content += f"- [{entry['title']}]({relative_path})\n"
+            saved = [entry for entry in entries if entry]
+            if not saved:
+                continue
+            parts.append(f"\n## {domain}\n\n")
+            parts.extend(f"- [{title}]({relative_path})\n" for title, relative_path in saved)
+        index_content = "".join(parts)
         
-        # Save index file
+        # Save index file in a single write
         index_path = os.path.join(base_path, "index.md")
-        with open(index_path, 'w', encoding='utf-8') as f:
-            f.write(index_content)
+        fd = os.open(index_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | _O_CLOEXEC, 0o644)
+        _write_and_close(fd, index_content)
             
     except Exception as e:
         print(f"Error creating index: {e}")
@@ -373,6 +758,7 @@ date_saved: {datetime.datetime.now().isoformat()}
         "processed": results,
         "base_path": base_path,
         "total_saved": len([r for r in results if r["status"] == "saved"]),
+        "total_skipped": len([r for r in results if r["status"] == "skipped"]),
         "total_errors": len([r for r in results if r["status"] == "error"])
     }
 